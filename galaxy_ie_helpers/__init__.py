@@ -4,11 +4,23 @@ from bioblend.galaxy import GalaxyInstance
 from bioblend.galaxy.histories import HistoryClient
 from bioblend.galaxy.datasets import DatasetClient
 from bioblend.galaxy.dataset_collections import DatasetCollectionClient
-import subprocess
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import socket
+import sys
+import struct
+import time
 import argparse
+import fcntl
+import functools
+import asyncio
+import json
 import re
+import shutil
 import os
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
 import logging
 if os.environ.get('DEBUG', "False").lower() == 'true':
@@ -18,21 +30,67 @@ if os.environ.get('INFO', "False").lower() == 'true':
 logging.getLogger("bioblend").setLevel(logging.CRITICAL)
 log = logging.getLogger()
 
+# Default gateway of the container, resolved once by _get_ip()
+_GALAXY_IP = None
+# Tested Galaxy connections, keyed by (history_id, obj)
+_CONN_CACHE = {}
+# On-disk cache of history contents, shared between processes
+_HISTORY_CACHE_DIR = '/import/.cache/history'
+# Seconds a cached copy may be used at most, as not every galaxy release
+# bumps the update_time of a history when its datasets change state
+_HISTORY_CACHE_TTL = int(os.environ.get('GALAXY_IE_HISTORY_TTL', '60'))
+# Connection pool size of the requests session, see _make_session()
+_POOL_MAX = int(os.environ.get('GALAXY_IE_POOL_MAX', '64'))
+# Dataset states that no longer change on their own
+_TERMINAL_STATES = frozenset(['ok', 'empty', 'error', 'failed_metadata', 'discarded', 'deferred'])
+
+
+@functools.lru_cache(maxsize=1)
+def _default_history():
+    """The id of the current galaxy history, as given by the environment."""
+    return os.environ['HISTORY_ID']
+
 
 def _get_ip():
     """Get IP address for the docker host
+
+    The docker host is the default gateway of the container, so we read it
+    straight from the kernel routing table. The result is cached for the
+    lifetime of the process.
     """
-    cmd_netstat = ['netstat', '-nr']
-    p1 = subprocess.Popen(cmd_netstat, stdout=subprocess.PIPE)
-    cmd_grep = ['grep', '^0\.0\.0\.0']
-    p2 = subprocess.Popen(cmd_grep, stdin=p1.stdout, stdout=subprocess.PIPE)
-    cmd_awk = ['awk', '{ print $2 }']
-    p3 = subprocess.Popen(cmd_awk, stdin=p2.stdout, stdout=subprocess.PIPE)
-    galaxy_ip = p3.stdout.read().decode().strip()
+    global _GALAXY_IP
+    if _GALAXY_IP is not None:
+        return _GALAXY_IP
+    galaxy_ip = ''
+    with open('/proc/net/route') as handle:
+        # Skip the header line
+        next(handle, None)
+        for line in handle:
+            fields = line.split()
+            if len(fields) > 2 and fields[1] == '00000000':
+                # The gateway is stored as little-endian hex
+                galaxy_ip = socket.inet_ntoa(struct.pack('<L', int(fields[2], 16)))
+                break
     log.debug('Host IP determined to be %s', galaxy_ip)
+    _GALAXY_IP = galaxy_ip
     return galaxy_ip
 
 
+def _make_session(key):
+    """Create a requests session with keep-alive and a connection pool large
+    enough for the parallel downloads. The pool size can be set with
+    GALAXY_IE_POOL_MAX."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16,
+                          pool_maxsize=_POOL_MAX,
+                          max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504)))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    session.headers['x-api-key'] = key
+    return session
+
+
 def _test_url(url, key, history_id, obj=True):
     """Test the functionality of a given galaxy URL, to ensure we can connect
     on that address."""
@@ -44,11 +102,13 @@ def _test_url(url, key, history_id, obj=True):
         else:
             gi = GalaxyInstance(url=url, key=key)
             gi.histories.show_history(history_id)
-        log.debug("TestURL url=%s state=success", url)
-        return gi
     except Exception:
         log.debug("TestURL url=%s state=failure", url)
         return None
+    log.debug("TestURL url=%s state=success", url)
+    if not obj:
+        gi.session = _make_session(key)
+    return gi
 
 
 def get_galaxy_connection(history_id=None, obj=True):
@@ -64,8 +124,20 @@ def get_galaxy_connection(history_id=None, obj=True):
         If that fails, we failover to using the URL the user is accessing
         through. This will succeed where the previous connection fails under
         the conditions of REMOTE_USER and galaxy running under uWSGI.
+        Successful connections are cached per process, see
+        invalidate_connection().
     """
-    history_id = history_id or os.environ['HISTORY_ID']
+    history_id = history_id or _default_history()
+    cache_key = (history_id, obj)
+    if cache_key in _CONN_CACHE:
+        return _CONN_CACHE[cache_key]
+    gi = _connect(history_id, obj)
+    _CONN_CACHE[cache_key] = gi
+    return gi
+
+
+def _connect(history_id, obj):
+    """Find a working galaxy URL and return a connected GalaxyInstance."""
     key = os.environ['API_KEY']
 
     ### Customised/Raw galaxy_url ###
@@ -103,22 +175,115 @@ def get_galaxy_connection(history_id=None, obj=True):
     raise Exception(msg)
 
 
+def invalidate_connection():
+    """
+        Forget all cached galaxy connections (and the detected host IP and
+        default history), so that the next call to get_galaxy_connection()
+        connects again.
+    """
+    global _GALAXY_IP
+    _CONN_CACHE.clear()
+    _GALAXY_IP = None
+    _default_history.cache_clear()
+
+
 def put(filenames, file_type='auto', history_id=None):
     """
         Given filename[s] of any file accessible to the docker instance, this
         function will upload that file[s] to galaxy using the current history.
         Does not return anything.
     """
-    if type(filenames) is str:
+    if isinstance(filenames, str):
         filenames = [filenames]
 
-    history_id = history_id or os.environ['HISTORY_ID']
+    history_id = history_id or _default_history()
     gi = get_galaxy_connection(history_id=history_id)
-    for filename in filenames:
+    history = gi.histories.get(history_id)
+
+    def upload(filename):
         log.info('Uploading gx=%s history=%s localpath=%s ft=%s', gi, history_id, filename, file_type)
-        history = gi.histories.get(history_id)
         history.upload_dataset(filename, file_type=file_type)
 
+    workers = int(os.environ.get('GALAXY_IE_UL_WORKERS', '8'))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(filenames)))) as executor:
+        # Consume the results so that upload errors are raised here
+        list(executor.map(upload, filenames))
+
+
+def _all_terminal(contents):
+    """Whether all datasets of the given history contents are in a final state."""
+    return all(item.get('state') in _TERMINAL_STATES
+               for item in contents if item.get('history_content_type', 'dataset') == 'dataset')
+
+
+def _cached_show_history(hc, history_id):
+    """
+        Return the contents of a history, like
+        hc.show_history(history_id, contents=True), but keep them on disk
+        under /import/.cache/history/. The cached copy is reused while it is
+        younger than GALAXY_IE_HISTORY_TTL seconds (default 60) and the
+        update_time of the history has not changed, which only needs the
+        small history summary instead of the full contents. Copies holding a
+        dataset that is still queued, running etc. are never reused, as its
+        state may have changed in the meantime. A call without a usable
+        cached copy therefore costs two requests instead of one.
+        See clear_history_cache() to drop the cached copies.
+    """
+    cache_file = os.path.join(_HISTORY_CACHE_DIR, '%s.json' % history_id)
+    try:
+        os.makedirs(_HISTORY_CACHE_DIR, exist_ok=True)
+        lock = open(cache_file + '.lock', 'w')
+    except (IOError, OSError):
+        log.debug('History cache unavailable, fetching history=%s', history_id)
+        return hc.show_history(history_id, contents=True)
+
+    with lock:
+        # Only one process at a time revalidates and rewrites the cache
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        update_time = hc.show_history(history_id)['update_time']
+        try:
+            with open(cache_file) as handle:
+                cached = json.load(handle)
+            if (cached['update_time'] == update_time
+                    and time.time() - cached['fetched'] < _HISTORY_CACHE_TTL
+                    and _all_terminal(cached['contents'])):
+                log.debug('Using cached contents of history=%s', history_id)
+                return cached['contents']
+        except (IOError, ValueError, KeyError):
+            pass
+        contents = hc.show_history(history_id, contents=True)
+        with open(cache_file + '.tmp', 'w') as handle:
+            json.dump({'update_time': update_time, 'fetched': time.time(), 'contents': contents}, handle)
+        os.replace(cache_file + '.tmp', cache_file)
+        return contents
+
+
+def clear_history_cache(history_id=None):
+    """
+        Drop the cached contents of the given history, or of all histories,
+        so that the next call fetches them from galaxy again.
+    """
+    if history_id:
+        names = ['%s.json' % history_id]
+    elif os.path.isdir(_HISTORY_CACHE_DIR):
+        names = os.listdir(_HISTORY_CACHE_DIR)
+    else:
+        names = []
+    for name in names:
+        if name.endswith('.json'):
+            try:
+                os.unlink(os.path.join(_HISTORY_CACHE_DIR, name))
+            except (IOError, OSError):
+                pass
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_patterns(patterns):
+    """Compile the given patterns as case-insensitive regexes. Each one is
+    compiled on its own, as joining them would break inline flags and
+    backreferences. Cached, as the same patterns tend to be used over and over."""
+    return tuple(re.compile(p, re.IGNORECASE) for p in patterns)
+
 
 def find_matching_history_ids(list_of_regex_patterns,
                               identifier_type='hid', history_id=None):
@@ -130,30 +295,271 @@ def find_matching_history_ids(list_of_regex_patterns,
        Return value[s] are the history ids of the datasets.
     """
     # We only deal with arrays, even if only single regex given
-    if type(list_of_regex_patterns) is str:
+    if isinstance(list_of_regex_patterns, str):
         list_of_regex_patterns = [list_of_regex_patterns]
 
-    history_id = history_id or os.environ['HISTORY_ID']
+    history_id = history_id or _default_history()
     gi = get_galaxy_connection(history_id=history_id, obj=False)
-    history_datasets = gi.histories.show_history(history_id=history_id)['state_ids']['ok']
+    # A single request for all contents is much faster than one show_dataset() per item
+    history_contents = _cached_show_history(gi.histories, history_id)
 
-    # Prepare regexes
-    patterns = [re.compile(r, re.IGNORECASE) for r in list_of_regex_patterns]
+    patterns = _compile_patterns(tuple(list_of_regex_patterns))
 
-    matching_ids = []
-    for dataset in history_datasets:
-        fstat = gi.datasets.show_dataset(dataset)
-        fname = fstat["name"]
-        fid = fstat["id"]
-        fhid = fstat["hid"]
+    # unique only
+    matching_ids = set()
+    for item in history_contents:
+        if item.get('state') != 'ok':
+            continue
+        fname = item["name"]
+        fid = item["id"]
+        fhid = item["hid"]
 
-        for pat in patterns:
-            if pat.match(fname):
-                log.debug("Matched on history item %s (%s) : '%s' " % (fhid, fid, fname))
-                matching_ids.append(fhid if identifier_type == "hid" else fid)
+        if any(pat.match(fname) for pat in patterns):
+            log.debug("Matched on history item %s (%s) : '%s' " % (fhid, fid, fname))
+            matching_ids.add(fhid if identifier_type == "hid" else fid)
 
-    # unique only
-    return(list(set(matching_ids)))
+    return(list(matching_ids))
+
+
+def _read_meta(file_path):
+    """Return the metadata stored next to a downloaded dataset, or None."""
+    try:
+        with open(file_path + '.meta.json') as handle:
+            return json.load(handle)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_meta(file_path, meta):
+    """Store metadata next to a downloaded dataset, so later cache hits do
+    not need to ask galaxy about it."""
+    with open(file_path + '.meta.json', 'w') as handle:
+        json.dump(meta, handle)
+
+
+def _iter_scandir(path):
+    """Recursively yield the directory entries below path."""
+    for entry in os.scandir(path):
+        yield entry
+        if entry.is_dir(follow_symlinks=False):
+            for sub_entry in _iter_scandir(entry.path):
+                yield sub_entry
+
+
+@functools.lru_cache(maxsize=1)
+def _use_uring():
+    """Whether to write extracted collection members through io_uring:
+    GALAXY_IE_IO_ENGINE=uring on Linux with liburing installed. liburing is
+    only imported here, so that it does not slow down every import."""
+    if os.environ.get('GALAXY_IE_IO_ENGINE') != 'uring' or not sys.platform.startswith('linux'):
+        return False
+    try:
+        import liburing
+    except ImportError:
+        log.debug('liburing is not installed, not using io_uring')
+        return False
+    # The bindings were rewritten in 2025 with an incompatible API
+    if not hasattr(liburing, 'io_uring_cqe'):
+        log.debug('Unsupported liburing version, not using io_uring')
+        return False
+    return True
+
+
+def _copy_uring(src, fd, max_batch=32):
+    """Copy the file object src to the file descriptor fd in 1 MiB chunks,
+    submitting up to max_batch writes per io_uring_enter call. Short writes
+    are resubmitted for the remaining bytes."""
+    import liburing
+    ring = liburing.io_uring()
+    cqe = liburing.io_uring_cqe()
+    liburing.io_uring_queue_init(max_batch, ring, 0)
+
+    def queue_write(index, data, offset):
+        sqe = liburing.io_uring_get_sqe(ring)
+        liburing.io_uring_prep_write(sqe, fd, data, len(data), offset)
+        liburing.io_uring_sqe_set_data64(sqe, index)
+
+    try:
+        offset = 0
+        eof = False
+        while not eof:
+            # Writes in flight by index: (iovec, bytes left to write, file offset).
+            # The iovecs keep the buffers alive until their writes completed.
+            pending = {}
+            while len(pending) < max_batch:
+                buf = bytearray(1 << 20)
+                size = src.readinto(buf)
+                if not size:
+                    eof = True
+                    break
+                iov = liburing.iovec(buf[:size] if size < len(buf) else buf)
+                data = memoryview(iov.iov_base)[:iov.iov_len]
+                pending[len(pending)] = (iov, data, offset)
+                queue_write(len(pending) - 1, data, offset)
+                offset += size
+            if not pending:
+                break
+            liburing.io_uring_submit(ring)
+            while pending:
+                liburing.io_uring_wait_cqe(ring, cqe)
+                res = cqe.res
+                index = cqe.user_data
+                liburing.io_uring_cqe_seen(ring, cqe)
+                if res < 0:
+                    raise OSError(-res, os.strerror(-res))
+                iov, data, write_offset = pending.pop(index)
+                if res < len(data):
+                    if res == 0:
+                        raise OSError("No progress writing %s bytes at offset %s" % (len(data), write_offset))
+                    # Short write, queue the rest again
+                    pending[index] = (iov, data[res:], write_offset + res)
+                    queue_write(index, data[res:], write_offset + res)
+                    liburing.io_uring_submit(ring)
+    finally:
+        liburing.io_uring_queue_exit(ring)
+
+
+def _extract_zip(zip_path, dest):
+    """Extract zip_path into the existing directory dest, copying members in
+    1 MiB chunks. Returns the names of the extracted files, relative to dest."""
+    real_dest = os.path.realpath(dest)
+    files = []
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            target = os.path.realpath(os.path.join(real_dest, member.filename))
+            # Never write outside of dest, like ZipFile.extractall()
+            if os.path.commonpath([real_dest, target]) != real_dest:
+                raise Exception("Refusing to extract %s outside of %s" % (member.filename, dest))
+            if member.filename.endswith('/'):
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                # Small members are done in one or two writes anyway, not worth a ring
+                if member.file_size > 1 << 20 and _use_uring():
+                    _copy_uring(src, dst.fileno())
+                else:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            files.append(member.filename)
+    return files
+
+
+def _unpack_collection(file_path):
+    """Extract a downloaded collection (file_path + '.zip') into file_path
+    and record its files in a manifest. Returns the extracted paths."""
+    # Extract next to the final directory and only move it into place once
+    # complete, so a failed extraction is never taken for a cached one
+    part_path = file_path + '.part'
+    shutil.rmtree(part_path, ignore_errors=True)
+    os.makedirs(part_path)
+    try:
+        names = _extract_zip(file_path + '.zip', part_path)
+    except Exception:
+        shutil.rmtree(part_path, ignore_errors=True)
+        raise
+    files = [os.path.join(file_path, name) for name in names]
+    with open(file_path + '.manifest', 'w') as handle:
+        handle.writelines(f + '\n' for f in files)
+    os.rename(part_path, file_path)
+    # The extracted files are all we need, don't keep the archive around
+    os.unlink(file_path + '.zip')
+    return files
+
+
+def _cached_files(file_path, content_type):
+    """Return the local paths of an already downloaded dataset or collection."""
+    if content_type == 'dataset':
+        return [file_path]
+    # The manifest written on download spares us walking the tree
+    if os.path.exists(file_path + '.manifest'):
+        with open(file_path + '.manifest') as handle:
+            return handle.read().splitlines()
+    # Walk instead of glob because glob will find folders.
+    # Here we filter on things that are files, not directories.
+    return [entry.path for entry in _iter_scandir(file_path) if entry.is_file(follow_symlinks=False)]
+
+
+def _resolve_datasets(hc, history_id, datasets_identifiers, identifier_type):
+    """Map the requested identifiers to (galaxy id, content type, state)
+    tuples, and to their datatype. Returns both mappings."""
+    # Datasets downloaded earlier carry their metadata in a sidecar file. Only
+    # ask galaxy for the history contents if that is missing for any of them,
+    # the download is gone or it was taken from another history.
+    datasets = {}
+    datatypes = {}
+    for dataset_id in datasets_identifiers:
+        file_path = '/import/%s' % dataset_id
+        meta = _read_meta(file_path) if os.path.exists(file_path) else None
+        if meta is None or meta.get('history_id') != history_id:
+            # Fetch the history contents only once, regardless of the number of datasets requested
+            history = _cached_show_history(hc, history_id)
+            datasets = {}
+            datatypes = {}
+            # Build both mappings in a single pass over the history
+            for ds in history:
+                key = ds[identifier_type]
+                datasets[key] = (ds['id'], ds['history_content_type'], ds.get('state'))
+                datatypes[key] = ds['extension']
+            break
+        key = int(dataset_id) if identifier_type == 'hid' else dataset_id
+        # Only finished datasets were downloaded and got a sidecar
+        datasets[key] = (meta['id'], meta['type'], 'ok')
+        datatypes[key] = meta['extension']
+    return datasets, datatypes
+
+
+def _download_ext(extension):
+    """The to_ext to request a dataset with, following bioblend's
+    download_dataset(): its own extension, or 'data' if it has none yet."""
+    if not extension or extension in ('auto', '_sniff_'):
+        return 'data'
+    return extension
+
+
+def _stream_download(gi, ds_id, file_path, extension):
+    """Stream the content of a dataset straight to file_path in 1 MiB
+    chunks, over the pooled session of the connection."""
+    url = '%s/api/datasets/%s/display' % (gi.base_url, ds_id)
+    with gi.session.get(url, params={'to_ext': _download_ext(extension)}, stream=True) as r:
+        r.raise_for_status()
+        # Undo any transfer compression while copying the raw stream
+        r.raw.decode_content = True
+        # Write to a temporary name, so an interrupted download is not taken for a cached one
+        with open(file_path + '.part', 'wb') as handle:
+            shutil.copyfileobj(r.raw, handle, 1 << 20)
+    os.rename(file_path + '.part', file_path)
+
+
+def _fetch_one(dataset_id, identifier_type, history_id, datasets, datatypes, gi, dc, dcc):
+    """Download a single dataset or collection to /import/ unless it is
+    already there. Returns the list of local paths."""
+    file_path = '/import/%s' % dataset_id
+    if identifier_type == 'hid':
+        dataset_id = int(dataset_id)
+    log.info('Downloading dataset=%s', dataset_id)
+    ds_id, content_type, state = datasets[dataset_id]
+    meta = {'id': ds_id, 'type': content_type, 'extension': datatypes.get(dataset_id), 'history_id': history_id}
+    # Cache the file requests. E.g. in the example of someone doing something
+    # silly like a get() for a Galaxy file in a for-loop, wouldn't want to
+    # re-download every time and add that overhead.
+    if not os.path.exists(file_path):
+        if content_type == 'dataset':
+            if state == 'ok':
+                _stream_download(gi, ds_id, file_path, datatypes.get(dataset_id))
+            else:
+                # bioblend waits for the dataset to be ready before downloading
+                dc.download_dataset(ds_id, file_path=file_path, use_default_filename=False)
+            _write_meta(file_path, meta)
+            return [file_path]
+        else:
+            log.info('Downloading collection dataset=%s', dataset_id)
+            dcc.download_dataset_collection(ds_id, file_path=file_path + '.zip')
+            files = _unpack_collection(file_path)
+            _write_meta(file_path, meta)
+            return files
+    else:
+        log.info('Cached, not re-downloading')
+        return _cached_files(file_path, content_type)
 
 
 def get(datasets_identifiers, identifier_type='hid', history_id=None, retrieve_datatype=None):
@@ -161,66 +567,51 @@ def get(datasets_identifiers, identifier_type='hid', history_id=None, retrieve_d
         Given the history_id that is displayed to the user, this function will
         either search for matching files in the history if the identifier_type
         is set to 'regex', otherwise it will directly download the file[s] from
-        the history and stores them under /import/.
+        the history and stores them under /import/. Identifiers given more
+        than once are only fetched and returned once, in the order of their
+        first appearance.
         Return value[s] are the path[s] to the dataset[s] stored under /import/
     """
-    history_id = history_id or os.environ['HISTORY_ID']
-    # The object version of bioblend is to slow in retrieving all datasets from a history
-    # fallback to the non-object path
-    gi = get_galaxy_connection(history_id=history_id, obj=False)
+    history_id = history_id or _default_history()
     file_path_all = []
-    datatypes_all = []
 
-    if type(datasets_identifiers) is not list:
+    if not isinstance(datasets_identifiers, list):
         datasets_identifiers = [datasets_identifiers]
 
     if identifier_type == "regex":
-        datasets_identifiers = find_matching_history_ids(datasets_identifiers)
+        datasets_identifiers = find_matching_history_ids(datasets_identifiers, history_id=history_id)
         identifier_type = "hid"
 
+    # Drop repeated identifiers, keeping the order of first appearance. Normalise
+    # them first, so that e.g. 1 and '1' are recognised as the same dataset.
+    normalise = int if identifier_type == 'hid' else str
+    datasets_identifiers = list(dict.fromkeys(normalise(d) for d in datasets_identifiers))
+
+    # Everything already downloaded: no need to talk to galaxy at all
+    file_paths = ['/import/%s' % dataset_id for dataset_id in datasets_identifiers]
+    if not retrieve_datatype and all(os.path.exists(file_path) for file_path in file_paths):
+        log.info('Cached, not re-downloading')
+        for file_path in file_paths:
+            content_type = 'dataset' if os.path.isfile(file_path) else 'dataset_collection'
+            file_path_all.extend(_cached_files(file_path, content_type))
+        return file_path_all[0] if len(file_path_all) == 1 else file_path_all
+
+    # The object version of bioblend is to slow in retrieving all datasets from a history
+    # fallback to the non-object path
+    gi = get_galaxy_connection(history_id=history_id, obj=False)
     hc = HistoryClient(gi)
     dc = DatasetClient(gi)
     dcc = DatasetCollectionClient(gi)
 
-    for dataset_id in datasets_identifiers:
-        file_path = '/import/%s' % dataset_id
-        log.info('Downloading gx=%s history=%s dataset=%s', gi, history_id, dataset_id)
-        # Cache the file requests. E.g. in the example of someone doing something
-        # silly like a get() for a Galaxy file in a for-loop, wouldn't want to
-        # re-download every time and add that overhead.
-        if not os.path.exists(file_path):
-            history = hc.show_history(history_id, contents=True)
-            datasets = {ds[identifier_type]: {'id': ds['id'], 'type': ds['history_content_type']} for ds in history}
-            if retrieve_datatype:
-                datatypes_all.append({ds[identifier_type]: ds['extension'] for ds in history})
-            if identifier_type == 'hid':
-                dataset_id = int(dataset_id)
-
-            if datasets[dataset_id]['type'] == 'dataset':
-                dc.download_dataset(datasets[dataset_id]['id'], file_path=file_path, use_default_filename=False)
-                file_path_all.append(file_path)
-            else:
-                log.info('Downloading collection gx=%s history=%s dataset=%s', gi, history_id, dataset_id)
-                dcc.download_dataset_collection(datasets[dataset_id]['id'], file_path=file_path + '.zip')
-                os.makedirs(file_path, exist_ok=True)
-                with zipfile.ZipFile(file_path + '.zip', 'r') as zip_ref:
-                    zip_ref.extractall(path=file_path)
-                    file_path_all.extend([os.path.join(file_path, x) for x in zip_ref.namelist()])
-        else:
-            hc = HistoryClient(gi)
-            dc = DatasetClient(gi)
-            history = hc.show_history(history_id, contents=True)
-            datatypes_all.append({ds[identifier_type]: ds['extension'] for ds in history})
-            log.info('Cached, not re-downloading')
-            if datasets[dataset_id]['type'] == 'dataset':
-                file_path_all.append(file_path)
-            else:
-                # Walk instead of glob because glob will find folders.
-                # Here we filter on things that are files, not directories.
-                files = [[os.path.join(r, f1) for f1 in f] for (r, d, f) in os.walk(file_path) if len(f) > 0]
-                # Flatten
-                files = [item for sublist in files for item in sublist]
-                file_path_all.extend(files)
+    datasets, datatypes = _resolve_datasets(hc, history_id, datasets_identifiers, identifier_type)
+
+    workers = int(os.environ.get('GALAXY_IE_DL_WORKERS', '8'))
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(datasets_identifiers)))) as executor:
+        futures = [executor.submit(_fetch_one, dataset_id, identifier_type, history_id, datasets, datatypes, gi, dc, dcc)
+                   for dataset_id in datasets_identifiers]
+        # Collect in submission order, so the paths keep the order of the identifiers
+        for future in futures:
+            file_path_all.extend(future.result())
 
 
     ## First path if only one item given, otherwise all paths.
@@ -228,25 +619,134 @@ def get(datasets_identifiers, identifier_type='hid', history_id=None, retrieve_d
     if retrieve_datatype:
         if len(file_path_all) == 1:
             dataset_number = int(file_path_all[0].strip().split("/")[-1])
-            return file_path_all, datatypes_all[0][dataset_number]
+            return file_path_all, datatypes[dataset_number]
         else:
             datatype_multi = dict()
             for i in file_path_all:
                 dataset_number = int(i.strip().split("/")[-1])
-                datatype_multi[dataset_number] = datatypes_all[0][dataset_number]
+                datatype_multi[dataset_number] = datatypes[dataset_number]
             return file_path_all, datatype_multi
     else:
         return file_path_all[0] if len(file_path_all) == 1 else file_path_all
 
+async def _aget_one(session, semaphore, url, file_path):
+    """Stream url to file_path in 1 MiB chunks."""
+    import aiofiles
+    async with semaphore:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            # Write to a temporary name, so an interrupted download is not taken for a cached one
+            async with aiofiles.open(file_path + '.part', 'wb') as handle:
+                async for chunk in resp.content.iter_chunked(1 << 20):
+                    await handle.write(chunk)
+    os.rename(file_path + '.part', file_path)
+
+
+async def _aget_all(downloads, key):
+    """Download all (url, file_path) pairs over one shared session."""
+    import aiohttp
+    semaphore = asyncio.Semaphore(32)
+    async with aiohttp.ClientSession(headers={'x-api-key': key}) as session:
+        await asyncio.gather(*[_aget_one(session, semaphore, url, file_path) for url, file_path in downloads])
+
+
+def _run_coroutine(coro):
+    """Run coro to completion and return its result. asyncio.run() refuses
+    to work inside a running event loop, like the one of a Jupyter kernel,
+    so in that case the coroutine gets its own loop on a worker thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def aget(datasets_identifiers, identifier_type='hid', history_id=None):
+    """
+        Same as get(), but all downloads run concurrently on a single asyncio
+        event loop with one aiohttp connection pool. This pays off when
+        fetching many small datasets. Requires aiohttp and aiofiles.
+        Return value[s] are the path[s] to the dataset[s] stored under /import/
+    """
+    # Only imported when needed, so that they do not slow down every import
+    try:
+        import aiohttp  # noqa: F401
+        import aiofiles  # noqa: F401
+    except ImportError:
+        raise Exception("aget() requires the aiohttp and aiofiles packages")
+
+    history_id = history_id or _default_history()
+    gi = get_galaxy_connection(history_id=history_id, obj=False)
+
+    if not isinstance(datasets_identifiers, list):
+        datasets_identifiers = [datasets_identifiers]
+
+    if identifier_type == "regex":
+        datasets_identifiers = find_matching_history_ids(datasets_identifiers, history_id=history_id)
+        identifier_type = "hid"
+
+    # Drop repeated identifiers, keeping the order of first appearance. Normalise
+    # them first, so that e.g. 1 and '1' are recognised as the same dataset.
+    normalise = int if identifier_type == 'hid' else str
+    datasets_identifiers = list(dict.fromkeys(normalise(d) for d in datasets_identifiers))
+
+    datasets, datatypes = _resolve_datasets(HistoryClient(gi), history_id, datasets_identifiers, identifier_type)
+
+    # Map every missing /import/ path to the url to fetch it from. Datasets
+    # that are not finished yet are left to bioblend, which waits for them.
+    downloads = {}
+    waiting = {}
+    for dataset_id in datasets_identifiers:
+        file_path = '/import/%s' % dataset_id
+        key = int(dataset_id) if identifier_type == 'hid' else dataset_id
+        if os.path.exists(file_path):
+            continue
+        ds_id, content_type, state = datasets[key]
+        if content_type != 'dataset':
+            downloads[file_path] = ('%s/api/dataset_collections/%s/download' % (gi.base_url, ds_id),
+                                    file_path + '.zip')
+        elif state == 'ok':
+            downloads[file_path] = ('%s/api/datasets/%s/display?to_ext=%s'
+                                    % (gi.base_url, ds_id, _download_ext(datatypes.get(key))), file_path)
+        else:
+            waiting[file_path] = ds_id
+    if downloads:
+        log.info('Downloading gx=%s history=%s count=%s', gi, history_id, len(downloads))
+        _run_coroutine(_aget_all(downloads.values(), gi.key))
+    if waiting:
+        dc = DatasetClient(gi)
+        for file_path, ds_id in waiting.items():
+            dc.download_dataset(ds_id, file_path=file_path, use_default_filename=False)
+    fresh = set(downloads) | set(waiting)
+
+    file_path_all = []
+    for dataset_id in datasets_identifiers:
+        file_path = '/import/%s' % dataset_id
+        key = int(dataset_id) if identifier_type == 'hid' else dataset_id
+        ds_id, content_type, _ = datasets[key]
+        if file_path not in fresh:
+            file_path_all.extend(_cached_files(file_path, content_type))
+            continue
+        if content_type == 'dataset':
+            file_path_all.append(file_path)
+        else:
+            file_path_all.extend(_unpack_collection(file_path))
+        _write_meta(file_path, {'id': ds_id, 'type': content_type, 'extension': datatypes.get(key),
+                                'history_id': history_id})
+
+    return file_path_all[0] if len(file_path_all) == 1 else file_path_all
+
+
 def get_user_history (history_id=None):
     """
        Get all visible dataset infos of user history.
        Return a list of dict of each dataset.
     """
-    history_id = history_id or os.environ['HISTORY_ID']
+    history_id = history_id or _default_history()
     gi = get_galaxy_connection(history_id=history_id, obj=False)
     hc = HistoryClient(gi)
-    history = hc.show_history(history_id, visible=True, contents=True)
+    history = [ds for ds in _cached_show_history(hc, history_id) if ds['visible']]
     return history
 
 
@@ -21,10 +21,22 @@ setup(
         'Topic :: Software Development',
         'Topic :: Software Development :: Code Generators',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
+    python_requires='>=3.7',
     install_requires=[
         "bioblend",
+        "requests",
     ],
+    extras_require={
+        'async': ["aiohttp", "aiofiles"],
+        'uring': ["liburing<2025"],
+    },
 )
@@ -0,0 +1,90 @@
+import io
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+from galaxy_ie_helpers import _copy_uring
+
+
+@unittest.skipUnless(sys.platform.startswith('linux') and liburing is not None
+                     and hasattr(liburing, 'io_uring_cqe'), 'needs liburing<2025 on Linux')
+class CopyUringTest(unittest.TestCase):
+
+    def _copy(self, data, **kwargs):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out')
+            with open(path, 'wb') as dst:
+                _copy_uring(io.BytesIO(data), dst.fileno(), **kwargs)
+            with open(path, 'rb') as handle:
+                return handle.read()
+
+    def test_copy_multiple_batches(self):
+        # More chunks than fit in one batch, with a partial last chunk
+        data = os.urandom(5 * (1 << 20) + 123)
+        self.assertEqual(self._copy(data, max_batch=2), data)
+
+    def test_copy_empty(self):
+        self.assertEqual(self._copy(b''), b'')
+
+
+def _short_writing_liburing():
+    """A stand-in for liburing whose writes complete at most 1000 bytes."""
+    fake = types.SimpleNamespace()
+    submitted = []
+    completed = []
+    fake.io_uring = lambda: None
+    fake.io_uring_cqe = types.SimpleNamespace
+    fake.io_uring_queue_init = lambda entries, ring, flags: 0
+    fake.io_uring_queue_exit = lambda ring: 0
+    fake.io_uring_get_sqe = lambda ring: types.SimpleNamespace()
+    fake.iovec = lambda buf: types.SimpleNamespace(iov_base=buf, iov_len=len(buf))
+
+    def prep_write(sqe, fd, buf, nbytes, offset):
+        sqe.write = (fd, bytes(buf[:nbytes]), offset)
+
+    def set_data64(sqe, data):
+        sqe.user_data = data
+        submitted.append(sqe)
+
+    def submit(ring):
+        while submitted:
+            sqe = submitted.pop(0)
+            fd, data, offset = sqe.write
+            completed.append((os.pwrite(fd, data[:1000], offset), sqe.user_data))
+        return 0
+
+    def wait_cqe(ring, cqe):
+        cqe.res, cqe.user_data = completed.pop(0)
+        return 0
+
+    fake.io_uring_prep_write = prep_write
+    fake.io_uring_sqe_set_data64 = set_data64
+    fake.io_uring_submit = submit
+    fake.io_uring_wait_cqe = wait_cqe
+    fake.io_uring_cqe_seen = lambda ring, cqe: None
+    return fake
+
+
+class CopyUringShortWriteTest(unittest.TestCase):
+
+    def test_short_writes_are_resubmitted(self):
+        data = os.urandom((1 << 20) + 4321)
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.dict(sys.modules, {'liburing': _short_writing_liburing()}):
+            path = os.path.join(tmp, 'out')
+            with open(path, 'wb') as dst:
+                _copy_uring(io.BytesIO(data), dst.fileno())
+            with open(path, 'rb') as handle:
+                self.assertEqual(handle.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()